@@ -4,7 +4,9 @@
 
 # Import modules
 import os
-from keras.models import load_model
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import pickle
 import pandas as pd
 
@@ -17,6 +19,10 @@ from .annotation import annotate_features, annotate_rois
 from .normalization import normalize_feature_list
 from .visualization import mirror_ms2_db, plot_network
 
+# ANN model for peak quality prediction, loaded once per process by _get_ann_model
+_ANN_MODEL = None
+_ANN_MODEL_PATH = os.path.join(os.path.dirname(__file__), 'model', "peak_quality_NN.keras")
+
 
 def feature_detection(file_name, params, annotation=False):
     """
@@ -51,13 +57,14 @@ def feature_detection(file_name, params, annotation=False):
 
     # predict feature quality. If the model is not loaded, load the model
     if d.params.ann_model is None:
-        data_path_ann = os.path.join(os.path.dirname(__file__), 'model', "peak_quality_NN.keras")
-        d.params.ann_model = load_model(data_path_ann)
+        d.params.ann_model = _get_ann_model()
     predict_quality(d)
 
     print("Number of extracted ROIs: " + str(len(d.rois)))
 
     # annotate isotopes, adducts, and in-source fragments
+    # the order matters: in-source fragments exclude isotopes, adducts exclude both,
+    # and all three sort d.rois in place, so they can't run concurrently
     annotate_isotope(d)
     annotate_in_source_fragment(d)
     annotate_adduct(d)
@@ -76,6 +83,8 @@ def feature_detection(file_name, params, annotation=False):
 def process_files(file_names, params):
     """
     A function to process multiple raw files.
+    If params.num_workers > 1, the files are processed in spawned worker processes,
+    so a script calling this function should be guarded by if __name__ == "__main__".
 
     Parameters
     ----------
@@ -89,18 +98,14 @@ def process_files(file_names, params):
     feature_list = []
 
     # load the ANN model for peak quality prediction
-    data_path_ann = os.path.join(os.path.dirname(__file__), 'model', "peak_quality_NN.keras")
-    params.ann_model = load_model(data_path_ann)
+    if params.num_workers > 1:
+        # the Keras model can't be sent to the worker processes, so each worker loads its own copy
+        params.ann_model = None
+    else:
+        params.ann_model = _get_ann_model()
 
     # process each file
-    for file_name in file_names:
-        print("Processing file: " + os.path.basename(file_name))
-        # feature detection
-        d = feature_detection(file_name, params)
-
-        # remove the features with scan number < 5 and no MS2 from the feature alignment
-        d.rois = [roi for roi in d.rois if roi.length >= 5 or roi.best_ms2 is not None]
-        print("Number of ROIs for alignment: " + str(len(d.rois)))
+    for file_name, d in _detect_features_in_files(file_names, params):
 
         if params.plot_bpc:
             d.plot_bpc(label_name=True, output=params.project_dir + "bpc_plot/" + os.path.basename(file_name).split(".")[0] + ".png")
@@ -129,6 +134,151 @@ def process_files(file_names, params):
     return feature_list
 
 
+def _get_ann_model():
+    """
+    Load the ANN model for peak quality prediction.
+    The model is only read from disk for the first call in a process.
+    """
+
+    global _ANN_MODEL
+
+    if _ANN_MODEL is None:
+        # import Keras here so that TensorFlow is only loaded when the model is needed
+        from keras.models import load_model
+        # the model is only used for inference, skip rebuilding the optimizer state
+        _ANN_MODEL = load_model(_ANN_MODEL_PATH, compile=False)
+
+    return _ANN_MODEL
+
+
+def _detect_features_in_files(file_names, params):
+    """
+    A generator to run feature detection on multiple raw files.
+    Files are processed in parallel if params.num_workers > 1, but
+    the results are always yielded in the order of file_names.
+
+    Parameters
+    ----------
+    file_names : list
+        A list of file names of the raw files in .mzML or .mzXML format.
+    params : Params object
+        The parameters for the workflow.
+    """
+
+    if params.num_workers > 1:
+        # spawn the workers instead of forking, since the main process may already hold an initialized TensorFlow runtime
+        mp_context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=params.num_workers, mp_context=mp_context, initializer=_init_worker_process) as executor:
+            # only keep a few files in flight, so finished MSData objects don't pile up in memory
+            # while the main process is still aligning earlier files
+            pending = deque()
+            next_idx = 0
+            for file_name in file_names:
+                while next_idx < len(file_names) and len(pending) < 2 * params.num_workers:
+                    pending.append(executor.submit(_feature_detection_in_subprocess, file_names[next_idx], params))
+                    next_idx += 1
+                d = pending.popleft().result()
+                yield file_name, d
+    elif len(file_names) > 0:
+        # detect the next file in a background thread while the current one is aligned
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(_feature_detection_for_alignment, file_names[0], params)
+            if len(file_names) > 1:
+                _prefetch_raw_file(file_names[1])
+            for i, file_name in enumerate(file_names):
+                d = future.result()
+                if i + 1 < len(file_names):
+                    future = executor.submit(_feature_detection_for_alignment, file_names[i+1], params)
+                if i + 2 < len(file_names):
+                    _prefetch_raw_file(file_names[i+2])
+                yield file_name, d
+
+
+def _prefetch_raw_file(file_name):
+    """
+    Ask the OS to read a raw file into the page cache in the background,
+    so reading it later doesn't wait on slow (e.g. network) storage.
+
+    Parameters
+    ----------
+    file_name : str
+        File name of the raw file.
+    """
+
+    # posix_fadvise is not available on Windows and macOS
+    if not hasattr(os, "posix_fadvise") or not os.path.isfile(file_name):
+        return
+
+    fd = os.open(file_name, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _feature_detection_for_alignment(file_name, params):
+    """
+    Feature detection of a single file in process_files.
+    ROIs that are not used for alignment are dropped right away, so that
+    they are not kept in memory or sent back from a worker process.
+
+    Parameters
+    ----------
+    file_name : str
+        File name of the raw file.
+    params : Params object
+        The parameters for the workflow.
+    """
+
+    print("Processing file: " + os.path.basename(file_name))
+    d = feature_detection(file_name, params)
+
+    # remove the features with scan number < 5 and no MS2 from the feature alignment
+    d.rois = [roi for roi in d.rois if roi.length >= 5 or roi.best_ms2 is not None]
+    print("Number of ROIs for alignment: " + str(len(d.rois)))
+
+    return d
+
+
+def _init_worker_process():
+    """
+    Set up a worker process of process_files before TensorFlow is loaded.
+    Each worker runs on one core, so TensorFlow is limited to one thread
+    to avoid oversubscribing the CPU.
+    """
+
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+    os.environ.setdefault("TF_NUM_INTRAOP_THREADS", "1")
+    os.environ.setdefault("TF_NUM_INTEROP_THREADS", "1")
+
+
+def _feature_detection_in_subprocess(file_name, params):
+    """
+    Feature detection in a worker process of process_files.
+
+    Parameters
+    ----------
+    file_name : str
+        File name of the raw file.
+    params : Params object
+        The parameters for the workflow.
+    """
+
+    d = _feature_detection_for_alignment(file_name, params)
+
+    # the loaded Keras model can't be pickled back to the main process
+    d.params.ann_model = None
+
+    # only the ROIs, parameters and BPC are used after feature detection, so the raw scans are not sent back
+    d.scans = []
+    d.ms1_idx = []
+    d.ms2_idx = []
+
+    return d
+
+
 def read_raw_file_to_obj(file_name, params=None):
     """
     Read a raw file to a MSData object.
@@ -171,7 +321,7 @@ def untargeted_workflow(parameters):
     
     # output feature list to a pickle file
     with open(parameters.project_dir + "mbe_project.mbe", "wb") as f:
-        pickle.dump(project_output, f)
+        pickle.dump(project_output, f, protocol=pickle.HIGHEST_PROTOCOL)
     
     # plot annoatated metabolites
     if parameters.plot_ms2_matching:
@@ -221,30 +371,20 @@ def _untargeted_workflow_preparation(parameters):
     bpc_dir = parameters.project_dir + "bpc_plot/"
     network_dir = parameters.project_dir + "network/"
     
-    if not os.path.exists(sample_dir):
-        os.makedirs(sample_dir)
-    if not os.path.exists(single_file_dir):
-        os.makedirs(single_file_dir)
-    if not os.path.exists(ms2_matching_dir):
-        os.makedirs(ms2_matching_dir)
-    if not os.path.exists(bpc_dir):
-        os.makedirs(bpc_dir)
-    if not os.path.exists(network_dir):
-        os.makedirs(network_dir)
+    os.makedirs(sample_dir, exist_ok=True)
+    os.makedirs(single_file_dir, exist_ok=True)
+    os.makedirs(ms2_matching_dir, exist_ok=True)
+    os.makedirs(bpc_dir, exist_ok=True)
+    os.makedirs(network_dir, exist_ok=True)
 
     # Move files to the sample folder if not moved
-    file_names = os.listdir(parameters.project_dir)
-    file_names = [file_name for file_name in file_names if file_name.endswith(".mzML") or file_name.endswith(".mzXML")]
-    if len(file_names) > 0:
-        for i in file_names:
-            os.rename(os.path.join(parameters.project_dir, i), os.path.join(parameters.project_dir, "sample", i))
+    for e in _raw_files_in_dir(parameters.project_dir):
+        os.rename(e.path, sample_dir + e.name)
     
     # Check the raw files are loaded
-    file_names = os.listdir(sample_dir)
-    if len(file_names) == 0:
+    raw_files = _raw_files_by_name(sample_dir)
+    if len(raw_files) == 0:
         raise ValueError("No raw files are found in the project directory.")
-    # Get raw file extension
-    file_ext = os.path.splitext(file_names[0])[1]
     
     # Sort the file names to process the data in the order of QC, sample, and blank
     # Check if the sample table is available
@@ -261,11 +401,56 @@ def _untargeted_workflow_preparation(parameters):
     blank_names = [i[0] for i in sample_groups if i[1].lower() == "blank"]
     sample_names = [i[0] for i in sample_groups if i[1].lower() != "qc" and i[1].lower() != "blank"]
     file_names = sample_names + qc_names + blank_names
-    file_names = [sample_dir + name + file_ext for name in file_names]
+
+    # Only process the samples with a raw file in the sample folder
+    # (pandas reads names like 1, 2, 3 as numbers, so they are compared as strings)
+    missing_names = [str(name) for name in file_names if str(name) not in raw_files]
+    if len(missing_names) > 0:
+        print("No raw files are found for the following samples: " + ", ".join(missing_names))
+    file_names = [raw_files[str(name)] for name in file_names if str(name) in raw_files]
+    if len(file_names) == 0:
+        raise ValueError("None of the samples in sample_table.csv matches a raw file in the sample folder.")
+    sample_groups = [i for i in sample_groups if str(i[0]) in raw_files]
 
     return file_names, sample_groups
 
 
+def _raw_files_in_dir(dir_path):
+    """
+    List the raw files (.mzML, .mzMLb, or .mzXML) in a directory with a single os.scandir call.
+
+    Parameters
+    ----------
+    dir_path : str
+        The directory to search.
+    """
+
+    with os.scandir(dir_path) as entries:
+        return [e for e in entries if e.is_file() and e.name.endswith((".mzML", ".mzMLb", ".mzXML"))]
+
+
+def _raw_files_by_name(dir_path):
+    """
+    Map the name (without extension) of each raw file in a directory to its path.
+    If a sample has more than one raw file, e.g. A.mzML and A.mzMLb, the format
+    that comes first in _RAW_FILE_PREFERENCE is used.
+
+    Parameters
+    ----------
+    dir_path : str
+        The directory to search.
+    """
+
+    raw_files = {}
+    for e in sorted(_raw_files_in_dir(dir_path), key=lambda e: _RAW_FILE_PREFERENCE.index(os.path.splitext(e.name)[1])):
+        raw_files.setdefault(os.path.splitext(e.name)[0], e.path)
+
+    return raw_files
+
+# mzMLb is preferred, since it's usually converted from the mzML file next to it
+_RAW_FILE_PREFERENCE = (".mzMLb", ".mzML", ".mzXML")
+
+
 def _bin_detection_single_file(file_name, params):
     """
     Bin detection from a raw LC-MS file (.mzML or .mzXML).
@@ -341,7 +526,7 @@ def process_files_for_bin_generation(file_names, params):
         output_file_name = os.path.basename(file_name)
         output_file_name = os.path.splitext(output_file_name)[0]
         with open(params.project_dir + "processed_data/" + output_file_name + ".pkl", "wb") as f:
-            pickle.dump(d, f)
+            pickle.dump(d, f, protocol=pickle.HIGHEST_PROTOCOL)
         
         # clear the memory
         del d
\ No newline at end of file
@@ -38,9 +38,17 @@ def alignement(feature_list, d):
         int_seq = np.array([roi.peak_height for roi in d.rois])
         labeled_roi = np.ones(len(d.rois), dtype=bool)
 
-        for feat in feature_list:
-            v = np.logical_and(np.abs(mz_seq - feat.mz) < d.params.align_mz_tol, np.abs(rt_seq - feat.rt) <= d.params.align_rt_tol)
-            v = np.where(np.logical_and(v, labeled_roi))[0]
+        # sort the rois by m/z once, so each feature only checks the rois in its m/z window
+        order = np.argsort(mz_seq, kind="stable")
+        mz_sorted = mz_seq[order]
+        lower_bounds = np.searchsorted(mz_sorted, [feat.mz - d.params.align_mz_tol for feat in feature_list], side="left")
+        upper_bounds = np.searchsorted(mz_sorted, [feat.mz + d.params.align_mz_tol for feat in feature_list], side="right")
+
+        for feat, lb, ub in zip(feature_list, lower_bounds, upper_bounds):
+            v = order[lb:ub]
+            v = v[np.abs(mz_seq[v] - feat.mz) < d.params.align_mz_tol]
+            v = v[np.logical_and(np.abs(rt_seq[v] - feat.rt) <= d.params.align_rt_tol, labeled_roi[v])]
+            v = np.sort(v)
 
             if len(v) == 0:
                 feat.extend_feat(roi=None)
@@ -175,12 +183,8 @@ class AlignedFeature:
         The best MS2 is the one with the highest summed intensity.
         """
 
-        total_ints = []
-        for ms2 in self.ms2_seq:
-            if ms2 is not None:
-                total_ints.append(np.sum(ms2.peaks[:,1]))
-            else:
-                total_ints.append(0.0)
+        # use the summed intensities cached on the scans
+        total_ints = [ms2.total_int if ms2 is not None else 0.0 for ms2 in self.ms2_seq]
         self.best_ms2 = self.ms2_seq[np.argmax(total_ints)]
     
 
@@ -207,6 +211,10 @@ class AlignedFeature:
         self.id = id
         self.mz_seq = np.array(self.mz_seq)
         self.rt_seq = np.array(self.rt_seq)
+        # store the intensities as contiguous arrays, which are much cheaper to pickle than lists of floats
+        self.peak_height_seq = np.array(self.peak_height_seq, dtype=np.float64)
+        self.peak_area_seq = np.array(self.peak_area_seq, dtype=np.float64)
+        self.top_average_seq = np.array(self.top_average_seq, dtype=np.float64)
         self.mz = np.mean(self.mz_seq[self.mz_seq > 0])
         self.rt = np.mean(self.rt_seq[self.rt_seq > 0])
         self.quality = self.highest_roi.quality
@@ -5,7 +5,6 @@
 
 # Import modules
 import numpy as np
-from scipy.interpolate import interp1d
 
 
 def predict_quality(d, model=None, threshold=0.5):
@@ -25,13 +24,23 @@ def predict_quality(d, model=None, threshold=0.5):
     if model is None:
         model = d.params.ann_model
 
-    temp = np.array([peak_interpolation(roi.int_seq) for roi in d.rois])
-    q = model.predict(temp, verbose=0)[:,0] > threshold
+    # only good rois can be overwritten, so short rois are not sent to the model
+    good_rois = [roi for roi in d.rois if roi.quality == 'good']
 
-    for i in range(len(d.rois)):
-        # if the roi quality is not good, then skip and don't overwrite
-        if d.rois[i].quality == 'good' and q[i] == 0:
-            d.rois[i].quality = 'bad peak shape'
+    if len(good_rois) == 0:
+        return
+
+    # the model takes float32 input, so fill it directly instead of stacking and casting
+    temp = np.empty((len(good_rois), 64), dtype=np.float32)
+    for i, roi in enumerate(good_rois):
+        temp[i] = peak_interpolation(roi.int_seq)
+
+    # predict all rois of the file in a single call to avoid the per-batch overhead of Keras
+    q = np.asarray(model.predict_on_batch(temp))[:,0] > threshold
+
+    for i in range(len(good_rois)):
+        if q[i] == 0:
+            good_rois[i].quality = 'bad peak shape'
 
 
 def peak_interpolation(peak):
@@ -44,9 +53,9 @@ def peak_interpolation(peak):
         A numpy array that contains the peak to be interpolated.
     '''
     
-    peak_interp_rule = interp1d(np.arange(len(peak)), peak, kind='linear')
+    # linear interpolation, np.interp avoids building a scipy interpolator for every peak
     interp_seed = np.linspace(0, len(peak)-1, 64)
-    peak_interp = peak_interp_rule(interp_seed)
+    peak_interp = np.interp(interp_seed, np.arange(len(peak)), peak)
 
     peak_interp = peak_interp / np.max(peak_interp)
 
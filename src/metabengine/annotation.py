@@ -4,6 +4,8 @@
 
 # Import modules
 import os
+import tempfile
+from importlib.metadata import version, PackageNotFoundError
 from ms_entropy import read_one_spectrum, FlashEntropySearch
 import pickle
 import numpy as np
@@ -25,11 +27,22 @@ def load_msms_db(path):
     ext = os.path.splitext(path)[1]
 
     if ext.lower() == '.msp':
+        # the indexed database is cached next to the MSP file, and reused until the MSP file is modified
+        cache_path = _msms_db_cache_path(path)
+        msp_stat = os.stat(path)
+        entropy_search = _read_msms_db_cache(cache_path, msp_stat)
+        if entropy_search is not None:
+            print("MS/MS database loaded.")
+            return entropy_search
+
         db =[]
         for a in read_one_spectrum(path):
             db.append(a)
         entropy_search = FlashEntropySearch()
         entropy_search.build_index(db)
+
+        _write_msms_db_cache(entropy_search, cache_path, msp_stat)
+
         print("MS/MS database loaded.")
         return entropy_search
     
@@ -46,6 +59,88 @@ def load_msms_db(path):
         return entropy_search
 
 
+def _msms_db_cache_path(path):
+    """
+    A function to get the path of the cached MS/MS database for a MSP file.
+    The ms_entropy version is part of the name, so a cache written by another version is not reused.
+
+    Parameters
+    ----------
+    path : str
+        The path to the MS/MS database in MSP format.
+    """
+
+    try:
+        ms_entropy_version = version("ms_entropy")
+    except PackageNotFoundError:
+        ms_entropy_version = "unknown"
+
+    return path + ".ms_entropy-" + ms_entropy_version + ".pkl"
+
+
+def _read_msms_db_cache(cache_path, msp_stat):
+    """
+    A function to read the cached MS/MS database.
+    The cache is only used if it was built from a MSP file with the same size and modification time.
+
+    Parameters
+    ----------
+    cache_path : str
+        The path of the cache file.
+    msp_stat : os.stat_result
+        The stat of the MSP file.
+
+    Returns
+    -------
+    FlashEntropySearch object or None
+        The indexed MS/MS database, or None if the cache is missing, outdated or unreadable.
+    """
+
+    if not os.path.exists(cache_path):
+        return None
+
+    try:
+        with open(cache_path, 'rb') as f:
+            cache = pickle.load(f)
+        if cache["msp_size"] == msp_stat.st_size and cache["msp_mtime_ns"] == msp_stat.st_mtime_ns:
+            return cache["entropy_search"]
+    except Exception:
+        print("Failed to read the cached MS/MS database from " + cache_path + ", rebuilding it.")
+
+    return None
+
+
+def _write_msms_db_cache(entropy_search, cache_path, msp_stat):
+    """
+    A function to cache the indexed MS/MS database.
+    The database is written to a temporary file first, so an interrupted write never leaves a truncated cache.
+
+    Parameters
+    ----------
+    entropy_search : FlashEntropySearch object
+        The indexed MS/MS database.
+    cache_path : str
+        The path of the cache file.
+    msp_stat : os.stat_result
+        The stat of the MSP file the database is built from.
+    """
+
+    cache = {"msp_size": msp_stat.st_size, "msp_mtime_ns": msp_stat.st_mtime_ns, "entropy_search": entropy_search}
+
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_path)), suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        tmp_path = None
+    except Exception:
+        print("Failed to cache the MS/MS database to " + cache_path)
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
 def annotate_features(feature_list, params):
     """
     A function to annotate features based on their MS/MS spectra and a MS/MS database.
@@ -62,40 +157,56 @@ def annotate_features(feature_list, params):
     entropy_search = load_msms_db(params.msms_library)
 
     for f in feature_list:
+        _annotate_feature(f, entropy_search, params)
+
+
+def _annotate_feature(f, entropy_search, params):
+    """
+    A function to annotate a single feature by identity search, and hybrid search if no identity is found.
+
+    Parameters
+    ----------
+    f : AlignedFeature object
+        The feature to be annotated.
+    entropy_search : FlashEntropySearch object
+        The indexed MS/MS database.
+    params : Params object
+        The parameters for the workflow.
+    """
+
+    if f.best_ms2 is not None:
+        peaks = entropy_search.clean_spectrum_for_search(f.mz, f.best_ms2.peaks)
+        entropy_similarity, matched_peaks_number = entropy_search.identity_search(precursor_mz=f.mz, peaks=peaks, ms1_tolerance_in_da=params.mz_tol_ms1, 
+                                                                                  ms2_tolerance_in_da=params.mz_tol_ms2, output_matched_peak_number=True)
         
-        if f.best_ms2 is not None:
-            peaks = entropy_search.clean_spectrum_for_search(f.mz, f.best_ms2.peaks)
-            entropy_similarity, matched_peaks_number = entropy_search.identity_search(precursor_mz=f.mz, peaks=peaks, ms1_tolerance_in_da=params.mz_tol_ms1, 
-                                                                                      ms2_tolerance_in_da=params.mz_tol_ms2, output_matched_peak_number=True)
-            
+        idx = np.argmax(entropy_similarity)
+        if entropy_similarity[idx] > params.ms2_sim_tol:
+            matched = entropy_search[idx]
+            matched = {k.lower():v for k,v in matched.items()}
+            f.annotation = matched['name']
+            f.similarity = entropy_similarity[idx]
+            f.matched_peak_number = matched_peaks_number[idx]
+            f.smiles = matched['smiles'] if 'smiles' in matched else None
+            f.inchikey = matched['inchikey'] if 'inchikey' in matched else None
+            f.matched_precursor_mz = matched['precursor_mz']
+            f.matched_peaks = matched['peaks']
+            f.formula = matched['formula'] if 'formula' in matched else None
+            f.annotation_mode = 'identity_search'
+        else:
+            entropy_similarity = entropy_search.hybrid_search(precursor_mz=f.mz, peaks=peaks, ms1_tolerance_in_da=params.mz_tol_ms1, 
+                                                              ms2_tolerance_in_da=params.mz_tol_ms2)
             idx = np.argmax(entropy_similarity)
             if entropy_similarity[idx] > params.ms2_sim_tol:
-                matched = entropy_search[np.argmax(entropy_similarity)]
+                matched = entropy_search[idx]
                 matched = {k.lower():v for k,v in matched.items()}
                 f.annotation = matched['name']
                 f.similarity = entropy_similarity[idx]
-                f.matched_peak_number = matched_peaks_number[idx]
                 f.smiles = matched['smiles'] if 'smiles' in matched else None
                 f.inchikey = matched['inchikey'] if 'inchikey' in matched else None
                 f.matched_precursor_mz = matched['precursor_mz']
                 f.matched_peaks = matched['peaks']
                 f.formula = matched['formula'] if 'formula' in matched else None
-                f.annotation_mode = 'identity_search'
-            else:
-                entropy_similarity = entropy_search.hybrid_search(precursor_mz=f.mz, peaks=peaks, ms1_tolerance_in_da=params.mz_tol_ms1, 
-                                                                  ms2_tolerance_in_da=params.mz_tol_ms2)
-                idx = np.argmax(entropy_similarity)
-                if entropy_similarity[idx] > params.ms2_sim_tol:
-                    matched = entropy_search[np.argmax(entropy_similarity)]
-                    matched = {k.lower():v for k,v in matched.items()}
-                    f.annotation = matched['name']
-                    f.similarity = entropy_similarity[idx]
-                    f.smiles = matched['smiles'] if 'smiles' in matched else None
-                    f.inchikey = matched['inchikey'] if 'inchikey' in matched else None
-                    f.matched_precursor_mz = matched['precursor_mz']
-                    f.matched_peaks = matched['peaks']
-                    f.formula = matched['formula'] if 'formula' in matched else None
-                    f.annotation_mode = 'hybrid_search'
+                f.annotation_mode = 'hybrid_search'
 
 
 def annotate_features_all_mode_search(feature_list, params, mode='hybrid'):
@@ -140,7 +251,7 @@ def annotate_features_all_mode_search(feature_list, params, mode='hybrid'):
             
             idx = np.argmax(entropy_similarity)
             if entropy_similarity[idx] > params.ms2_sim_tol:
-                matched = entropy_search[np.argmax(entropy_similarity)]
+                matched = entropy_search[idx]
                 matched = {k.lower():v for k,v in matched.items()}
                 f.annotation = matched['name']
                 f.similarity = entropy_similarity[idx]
@@ -183,7 +294,7 @@ def annotate_rois(d):
             
             idx = np.argmax(entropy_similarity)
             if entropy_similarity[idx] > d.params.ms2_sim_tol:
-                matched = entropy_search[np.argmax(entropy_similarity)]
+                matched = entropy_search[idx]
                 matched = {k.lower():v for k,v in matched.items()}
                 f.annotation = matched['name']
                 f.similarity = entropy_similarity[idx]
@@ -23,6 +23,8 @@ def annotate_isotope(d):
     d.rois.sort(key=lambda x: x.mz)
     mz_seq = np.array([roi.mz for roi in d.rois])
     rt_seq = np.array([roi.rt for roi in d.rois])
+    # peak heights are gathered once, so the isotope filters work on arrays instead of roi attributes
+    height_seq = np.array([roi.peak_height for roi in d.rois])
 
     for r in d.rois:
         
@@ -38,20 +40,24 @@ def annotate_isotope(d):
         last_mz = r.mz
         isotope_id_seq = []
 
+        # the rois are sorted by m/z, so only the rois in the m/z window of each isotope are checked
+        lower_bounds = np.searchsorted(mz_seq, isotopes - 0.005, side="left")
+        upper_bounds = np.searchsorted(mz_seq, isotopes + 0.005, side="right")
+
         # find roi using isotope list
-        for iso in isotopes:
+        for iso, lb, ub in zip(isotopes, lower_bounds, upper_bounds):
             
             # if isotpoe is not found in two daltons, stop searching
             if iso - last_mz > 1.2 and iso - r.mz > 2.2:
                 break
 
-            v = np.where(np.logical_and(np.abs(mz_seq - iso) < 0.005, np.abs(rt_seq - r.rt) < 0.1))[0]
+            v = np.where(np.logical_and(np.abs(mz_seq[lb:ub] - iso) < 0.005, np.abs(rt_seq[lb:ub] - r.rt) < 0.1))[0] + lb
 
             if len(v) == 0:
                 continue
 
             # isotope can't have intensity 3 fold or higher than M0
-            v = [v[i] for i in range(len(v)) if d.rois[v[i]].peak_height < 3*r.peak_height]
+            v = v[height_seq[v] < 3*r.peak_height]
 
             cors = [peak_peak_correlation(r, d.rois[vi]) for vi in v]
 
@@ -60,7 +66,7 @@ def annotate_isotope(d):
             if len(v) == 0:
                 continue
             
-            total_int = np.sum([d.rois[vi].peak_height for vi in v])
+            total_int = np.sum(height_seq[v])
 
             if iso - r.mz > 2.2 and total_int > r.peak_height:
                 break
@@ -92,35 +98,47 @@ def annotate_in_source_fragment(d):
         An MSData object that contains the detected rois to be grouped.
     """
 
-    # sort ROI by m/z from high to low
-    d.rois.sort(key=lambda x: x.mz, reverse=True)
+    # sort ROI by m/z from low to high
+    d.rois.sort(key=lambda x: x.mz)
     mz_seq = np.array([roi.mz for roi in d.rois])
     rt_seq = np.array([roi.rt for roi in d.rois])
 
-    labeled_roi = np.ones(len(d.rois), dtype=bool)
+    # parents are evaluated from high to low m/z (ties keep their order), without re-sorting d.rois
+    parent_order = np.argsort(-mz_seq, kind="stable")
+    parent_rank = np.empty(len(parent_order), dtype=np.int64)
+    parent_rank[parent_order] = np.arange(len(parent_order))
 
     # isotopes can't be parent or child
-    for idx, r in enumerate(d.rois):
-        if r.is_isotope:
-            labeled_roi[idx] = False
+    labeled_roi = np.array([not r.is_isotope for r in d.rois], dtype=bool)
     
     # find in-source fragments
-    for idx, r in enumerate(d.rois):
+    for idx in parent_order:
+
+        r = d.rois[idx]
 
         # roi with no MS2 spectrum can't be a parent
         if not labeled_roi[idx] or r.best_ms2 is None or r.length < 5:
             continue
 
-        for m in r.best_ms2.peaks[:, 0]:
+        # find the m/z windows of all fragments at once
+        frag_mzs = r.best_ms2.peaks[:, 0]
+        lower_bounds = np.searchsorted(mz_seq, frag_mzs - 0.01, side="left")
+        upper_bounds = np.searchsorted(mz_seq, frag_mzs + 0.01, side="right")
+
+        for m, lb, ub in zip(frag_mzs, lower_bounds, upper_bounds):
 
-            v = np.logical_and(np.abs(mz_seq - m) < 0.01, np.abs(rt_seq - r.rt) <= 0.1)
-            v = np.where(np.logical_and(v, labeled_roi))[0]
+            if lb == ub:
+                continue
+
+            v = np.logical_and(np.abs(mz_seq[lb:ub] - m) < 0.01, np.abs(rt_seq[lb:ub] - r.rt) <= 0.1)
+            v = np.where(np.logical_and(v, labeled_roi[lb:ub]))[0] + lb
 
             if len(v) == 0:
                 continue
 
             if len(v) > 1:
-                # select the one with the lowest scan difference
+                # select the one with the lowest scan difference (ties go to the higher m/z)
+                v = v[np.argsort(parent_rank[v])]
                 v = v[np.argmin(np.abs(rt_seq[v] - r.rt))]
             else:
                 v = v[0]
@@ -135,8 +153,6 @@ def annotate_in_source_fragment(d):
                 d.rois[v].in_source_fragment = True
                 d.rois[v].isf_parent_roi_id = r.id
                 r.isf_child_roi_id.append(d.rois[v].id)
-    
-    d.rois.sort(key=lambda x: x.mz)
 
 
 def annotate_adduct(d):
@@ -161,13 +177,18 @@ def annotate_adduct(d):
         if r.is_isotope or r.in_source_fragment:
             labeled_roi[idx] = False
 
+    # adduct names and mass differences are looked up once, the multimer differences depend on each roi
     if d.params.ion_mode.lower() == "positive":
         default_adduct = "[M+H]+"
-        adduct_mass_diffence = _ADDUCT_MASS_DIFFERENCE_POS_AGAINST_H
+        adduct_names = list(_ADDUCT_MASS_DIFFERENCE_POS_AGAINST_H.keys()) + ['[2M+H]+', '[3M+H]+']
+        adduct_mass_diffence = np.array(list(_ADDUCT_MASS_DIFFERENCE_POS_AGAINST_H.values()) + [0.0, 0.0])
+        m_offset = -1.007276
 
     elif d.params.ion_mode.lower() == "negative":
         default_adduct = "[M-H]-"
-        adduct_mass_diffence = _ADDUCT_MASS_DIFFERENCE_NEG_AGAINST_H
+        adduct_names = list(_ADDUCT_MASS_DIFFERENCE_NEG_AGAINST_H.keys()) + ['[2M-H]-', '[3M-H]-']
+        adduct_mass_diffence = np.array(list(_ADDUCT_MASS_DIFFERENCE_NEG_AGAINST_H.values()) + [0.0, 0.0])
+        m_offset = 1.007276
 
 
     # find adducts by assuming the current roi is the [M+H]+ ion in positive mode and [M-H]- ion in negative mode
@@ -186,17 +207,17 @@ def annotate_adduct(d):
                 r.adduct_type = "[M-2H]2-"
             continue
         
-        if d.params.ion_mode.lower() == "positive":
-            adduct_mass_diffence['[2M+H]+'] = r.mz - 1.007276
-            adduct_mass_diffence['[3M+H]+'] = 2*(r.mz - 1.007276)
-        elif d.params.ion_mode.lower() == "negative":
-            adduct_mass_diffence['[2M-H]-'] = r.mz + 1.007276
-            adduct_mass_diffence['[3M-H]-'] = 2*(r.mz + 1.007276)
-
-        for adduct in adduct_mass_diffence.keys():
-            m = r.mz + adduct_mass_diffence[adduct]
-            v = np.logical_and(np.abs(mz_seq - m) < 0.01, np.abs(rt_seq - r.rt) <= 0.1)
-            v = np.where(np.logical_and(v, labeled_roi))[0]
+        adduct_mass_diffence[-2] = r.mz + m_offset
+        adduct_mass_diffence[-1] = 2*(r.mz + m_offset)
+
+        # the rois are sorted by m/z, so the m/z windows of all adducts are found at once
+        target_mzs = r.mz + adduct_mass_diffence
+        lower_bounds = np.searchsorted(mz_seq, target_mzs - 0.01, side="left")
+        upper_bounds = np.searchsorted(mz_seq, target_mzs + 0.01, side="right")
+
+        for adduct, m, lb, ub in zip(adduct_names, target_mzs, lower_bounds, upper_bounds):
+            v = np.logical_and(np.abs(mz_seq[lb:ub] - m) < 0.01, np.abs(rt_seq[lb:ub] - r.rt) <= 0.1)
+            v = np.where(np.logical_and(v, labeled_roi[lb:ub]))[0] + lb
 
             if len(v) == 0:
                 continue
@@ -240,22 +261,42 @@ def peak_peak_correlation(roi1, roi2):
         The peak-peak correlation between the two rois.
     """
 
-    # find the common scans in the two rois
-    common_scans = np.intersect1d(roi1.scan_idx_seq, roi2.scan_idx_seq)
+    # find the common scans in the two rois (scan indices are unique and ascending in a roi)
+    scans1 = np.asarray(roi1.scan_idx_seq)
+    scans2 = np.asarray(roi2.scan_idx_seq)
+    pos = np.searchsorted(scans1, scans2)
+    matched = scans1[np.minimum(pos, len(scans1) - 1)] == scans2
+    idx1 = pos[matched]
+    idx2 = np.nonzero(matched)[0]
 
-    if len(common_scans) < 2:
+    if len(idx1) < 2:
         return 1.0
 
     # find the intensities of the common scans in the two rois
-    int1 = roi1.int_seq[np.isin(roi1.scan_idx_seq, common_scans)]
-    int2 = roi2.int_seq[np.isin(roi2.scan_idx_seq, common_scans)]
+    int1 = roi1.int_seq[idx1]
+    int2 = roi2.int_seq[idx2]
 
     # calculate the correlation
-    pp_cor = np.corrcoef(int1, int2)[0, 1]
+    pp_cor = _pearson(int1, int2)
 
     return pp_cor
 
 
+def _pearson(x, y):
+    """
+    A function to calculate the Pearson correlation coefficient of two vectors.
+    It gives the same result as np.corrcoef(x, y)[0, 1] without building the covariance matrix.
+    """
+
+    x = x - np.mean(x)
+    y = y - np.mean(y)
+
+    r = np.dot(x, y) / np.sqrt(np.dot(x, x) * np.dot(y, y))
+
+    # same as np.corrcoef, clip the rounding errors
+    return np.clip(r, -1.0, 1.0)
+
+
 def get_charge_state(mz_seq):
     
     if len(mz_seq) < 2:
@@ -110,9 +110,9 @@ def normalize_feature_list(feature_list, method='pqn', blank_sample_idx=None):
     if blank_sample_idx is not None:
         v[blank_sample_idx] = 1
 
+    # the intensity sequences are float arrays after summarizing the features, so each one is divided at once
     for f in feature_list:
-        for i in range(len(f.peak_height_seq)):
-            f.peak_height_seq[i] /= v[i]
-            f.peak_area_seq[i] /= v[i]
-            f.top_average_seq[i] /= v[i]
+        f.peak_height_seq /= v
+        f.peak_area_seq /= v
+        f.top_average_seq /= v
     return v
\ No newline at end of file
@@ -28,6 +28,7 @@ class Params:
         self.roi_gap = 2          # Gap within a feature, default is 2 (i.e. 2 consecutive scans without signal)
         self.min_ion_num = 10     # Minimum scan number a feature, default is 10
         self.cut_roi = True       # Whether to cut ROI, default is True
+        self.num_workers = 1      # Number of processes for feature detection, default is 1 (files are processed one by one)
 
         # Parameters for feature alignment
         self.align_mz_tol = 0.01        # m/z tolerance for MS1, default is 0.01
@@ -57,7 +58,7 @@ class Params:
         self.plot_network = False   # Whether to plot network, default is False
 
         # Other parameters (only change if necessary)
-        self.ann_model = None     # ANN model for peak quality prediction, default is None
+        self.ann_model = None     # ANN model for peak quality prediction, default is None (loaded on demand by feature_detection)
 
 
     def __str__(self):
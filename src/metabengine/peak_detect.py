@@ -7,7 +7,6 @@ import numpy as np
 from tqdm import tqdm
 from scipy.signal import argrelextrema
 from ms_entropy import calculate_entropy_similarity
-import copy
 
 
 def roi_finder(d, params, **kwargs):
@@ -27,6 +26,14 @@ def roi_finder(d, params, **kwargs):
     # A list for finally selected ROIs
     final_rois = []
 
+    # The nearest ion search requires the ions in each MS1 scan to be sorted by m/z
+    for ms1_idx in d.ms1_idx:
+        s = d.scans[ms1_idx]
+        if np.any(np.diff(s.mz_seq) < 0):
+            order = np.argsort(s.mz_seq, kind="stable")
+            s.mz_seq = s.mz_seq[order]
+            s.int_seq = s.int_seq[order]
+
     # Initiate a set of rois using the first MS1 scan
     fs = d.scans[d.ms1_idx[0]]    # The first scan
 
@@ -38,6 +45,10 @@ def roi_finder(d, params, **kwargs):
         if allocate_vec[i] > 0:
             roi.ms2_seq.append(d.scans[allocate_vec[i]])
         rois.append(roi)
+
+    # m/z and gap counters of the rois in progress, kept in the same order as rois
+    roi_mz = np.array(fs.mz_seq, dtype=np.float64)
+    gap_counter = np.zeros(len(rois), dtype=np.int64)
     
     last_ms1_idx = d.ms1_idx[0]
     last_rt = fs.rt
@@ -50,51 +61,51 @@ def roi_finder(d, params, **kwargs):
         # Find the MS2 for this scan
         allocate_vec = loc_ms2_for_ms1_scan(d, ms1_idx)
 
-        visited_idx = []    # A list to store the visited indices of ions in the current MS1 scan
-        visited_rois_idx = []   # A list to store the visited indices of rois
+        visited_rois = np.zeros(len(rois), dtype=bool)   # rois extended by an ion of the current MS1 scan
 
-        # Loop over all current rois
-        for i, roi in enumerate(rois):
-            
-            mz_diff = np.abs(roi.mz - s.mz_seq)
+        # Find the nearest ion for all current rois at once
+        nearest_idx, nearest_diff = _find_nearest_ions(s.mz_seq, roi_mz)
 
-            min_idx = np.argmin(mz_diff)
+        # An ion can only extend one roi: the first roi (in the order of rois) within the tolerance claims it
+        candidates = np.nonzero(nearest_diff < params.mz_tol_ms1)[0]
+        visited_idx, first = np.unique(nearest_idx[candidates], return_index=True)
+        winners = candidates[first]
+        visited_rois[winners] = True
 
-            if mz_diff[min_idx] < params.mz_tol_ms1:
-                if min_idx not in visited_idx:
-                    roi.extend_roi(scan_idx=ms1_idx, rt=s.rt, mz=s.mz_seq[min_idx], intensity=s.int_seq[min_idx])
-                    
-                    roi.gap_counter = 0
-
-                    if allocate_vec[min_idx] > 0:
-                        roi.ms2_seq.append(d.scans[allocate_vec[min_idx]])
-                    visited_idx.append(min_idx)
-                    visited_rois_idx.append(i)
-            
-        to_be_moved = []
+        # Extend the rois that claimed an ion
+        for i, min_idx in zip(winners, visited_idx):
+            roi = rois[i]
+            roi.extend_roi(scan_idx=ms1_idx, rt=s.rt, mz=s.mz_seq[min_idx], intensity=s.int_seq[min_idx])
 
-        # Plus one to the gap counter of the rois that are not visited
-        for i in range(len(rois)):
-            if i not in visited_rois_idx:
-                rois[i].extend_roi(scan_idx=ms1_idx, rt=s.rt, mz=np.nan, intensity=0)
+            if allocate_vec[min_idx] > 0:
+                roi.ms2_seq.append(d.scans[allocate_vec[min_idx]])
 
-                rois[i].gap_counter = rois[i].gap_counter + 1
-                if rois[i].gap_counter > params.roi_gap:
-                    to_be_moved.append(i)
+        # Reset the gap counter of the visited rois and plus one to the others
+        gap_counter[visited_rois] = 0
+        gap_counter[~visited_rois] += 1
+        for i in np.nonzero(~visited_rois)[0]:
+            rois[i].extend_roi(scan_idx=ms1_idx, rt=s.rt, mz=np.nan, intensity=0)
         
         # Move the rois that have not been visited for a long time to final_rois
+        to_be_moved = np.nonzero(gap_counter > params.roi_gap)[0]
         for i in to_be_moved[::-1]:
             final_rois.append(rois.pop(i))
+        roi_mz = np.delete(roi_mz, to_be_moved)
+        gap_counter = np.delete(gap_counter, to_be_moved)
         
         # Create new rois for the rest
-        for i in range(len(s.int_seq)):
-            if i not in visited_idx:
-                # Add a zero before the new roi
-                roi = Roi(scan_idx=last_ms1_idx, rt=last_rt, mz=s.mz_seq[i], intensity=0)
-                roi.extend_roi(scan_idx=ms1_idx, rt=s.rt, mz=s.mz_seq[i], intensity=s.int_seq[i])
-                if allocate_vec[i] > 0:
-                    roi.ms2_seq.append(d.scans[allocate_vec[i]])
-                rois.append(roi)
+        visited_ions = np.zeros(len(s.int_seq), dtype=bool)
+        visited_ions[visited_idx] = True
+        new_idx = np.nonzero(~visited_ions)[0]
+        for i in new_idx:
+            # Add a zero before the new roi
+            roi = Roi(scan_idx=last_ms1_idx, rt=last_rt, mz=s.mz_seq[i], intensity=0)
+            roi.extend_roi(scan_idx=ms1_idx, rt=s.rt, mz=s.mz_seq[i], intensity=s.int_seq[i])
+            if allocate_vec[i] > 0:
+                roi.ms2_seq.append(d.scans[allocate_vec[i]])
+            rois.append(roi)
+        roi_mz = np.concatenate((roi_mz, s.mz_seq[new_idx]))
+        gap_counter = np.concatenate((gap_counter, np.zeros(len(new_idx), dtype=np.int64)))
         last_ms1_idx = ms1_idx
         last_rt = s.rt
            
@@ -105,6 +116,45 @@ def roi_finder(d, params, **kwargs):
     return final_rois
 
 
+def _find_nearest_ions(mz_seq, target_mzs):
+    """
+    A function to find the nearest ion in a scan for each target m/z.
+
+    Parameters
+    ----------------------------------------------------------
+    mz_seq: numpy array
+        m/z of the ions in a scan, sorted from low to high.
+    target_mzs: numpy array
+        Target m/z values.
+
+    Returns
+    ----------------------------------------------------------
+    nearest_idx: numpy array
+        Index of the nearest ion for each target m/z.
+    mz_diff: numpy array
+        Absolute m/z difference between each target and its nearest ion.
+    """
+
+    if len(mz_seq) == 0:
+        return np.zeros(len(target_mzs), dtype=int), np.full(len(target_mzs), np.inf)
+
+    # the nearest ion is either right before or right after the insertion point
+    pos = np.searchsorted(mz_seq, target_mzs)
+    left = np.clip(pos - 1, 0, len(mz_seq) - 1)
+    # if the left ion's m/z appears more than once, take the first one as np.argmin does
+    left = np.searchsorted(mz_seq, mz_seq[left], side="left")
+    right = np.clip(pos, 0, len(mz_seq) - 1)
+    left_diff = np.abs(target_mzs - mz_seq[left])
+    right_diff = np.abs(target_mzs - mz_seq[right])
+
+    # same as np.argmin, the ion with the lower index wins a tie
+    use_left = left_diff <= right_diff
+    nearest_idx = np.where(use_left, left, right)
+    mz_diff = np.where(use_left, left_diff, right_diff)
+
+    return nearest_idx, mz_diff
+
+
 def find_roi_cut(roi, params):
     """
     A function to find place to cut an roi based on ion identity.
@@ -120,27 +170,27 @@ def find_roi_cut(roi, params):
         A Params object that contains the parameters.
     """
 
+    # the trace is still a list here, so it's converted once for both checks below
+    int_seq = np.asarray(roi.int_seq)
+
     # counter the number of non-zero intensities in the roi
-    non_zero_int = np.count_nonzero(roi.int_seq)
+    non_zero_int = np.count_nonzero(int_seq)
 
     if non_zero_int >= params.min_ion_num and len(roi.ms2_seq) >= 2:
 
-        cut_positions = argrelextrema(np.array(roi.int_seq), np.less)[0]
+        cut_positions = argrelextrema(int_seq, np.less)[0]
 
         if len(cut_positions) != 0:
             final_cut_positions = []
             
-            scan_for_cut = [roi.scan_idx_seq[i] for i in cut_positions]
-            ms2_scan_number = [ms2.scan for ms2 in roi.ms2_seq]
-            indices = np.searchsorted(np.array(ms2_scan_number), np.array(scan_for_cut))
-            ms2_groups = [len(group) for group in np.split(ms2_scan_number, indices)]
-
-            best_ms2s = []
-            a = 0
-            for i in ms2_groups:
-                b = a + i
-                best_ms2s.append(find_best_ms2(roi.ms2_seq[a:b]))
-                a = b            
+            # the MS2 spectra are in scan order, so the segments between cut positions are slices of ms2_seq
+            scan_for_cut = np.asarray(roi.scan_idx_seq)[cut_positions]
+            ms2_scan_number = np.fromiter((ms2.scan for ms2 in roi.ms2_seq), dtype=np.int64, count=len(roi.ms2_seq))
+            indices = np.searchsorted(ms2_scan_number, scan_for_cut)
+            starts = [0] + indices.tolist()
+            ends = indices.tolist() + [len(roi.ms2_seq)]
+
+            best_ms2s = [find_best_ms2(roi.ms2_seq[a:b]) for a, b in zip(starts, ends)]
 
             ms2_ref = None
             for i in range(len(best_ms2s)):
@@ -182,16 +232,18 @@ def roi_cutter(roi, positions):
         roi.int_seq[i] = roi.int_seq[i] / 2
 
     # add a zero and len(int_seq) to positions
-    positions = np.insert(np.array([0, len(roi.int_seq)-1]), 1, positions)
+    bounds = np.empty(len(positions)+2, dtype=np.int64)
+    bounds[0] = 0
+    bounds[1:-1] = positions
+    bounds[-1] = len(roi.int_seq)-1
+    positions = bounds
 
     rois = []
 
     for i in range(len(positions)-1):
         fst = positions[i]
         snd = positions[i+1]+1
-        temp = copy.deepcopy(roi)
-        temp.subset_roi(fst, snd)
-        rois.append(temp)
+        rois.append(Roi._from_slice(roi, fst, snd))
 
     return rois
     
@@ -199,6 +251,7 @@ def roi_cutter(roi, positions):
 def loc_ms2_for_ms1_scan(d, ms1_idx):
     """
     A function to allocate MS2 scans for the ions in a given MS1 scan.
+    The ions in the MS1 scan should be sorted by m/z (see roi_finder).
 
     Parameters
     ----------------------------------------------------------
@@ -208,16 +261,26 @@ def loc_ms2_for_ms1_scan(d, ms1_idx):
         The index of the MS1 scan.
     """
 
-    allocate_vec = [0] * len(d.scans[ms1_idx].mz_seq)
-    mz_vec = d.scans[ms1_idx].mz_seq
+    allocate_vec = np.zeros(len(d.scans[ms1_idx].mz_seq), dtype=np.int64)
 
+    # MS2 scans between this MS1 scan and the next one
+    ms2_idx = []
     for i in range(ms1_idx+1, len(d.scans)):
         if d.scans[i].level == 1:
             break
         if d.scans[i].level == 2:
-            mz_diff = np.abs(mz_vec - d.scans[i].precursor_mz)
-            if np.min(mz_diff) < 0.01:
-                allocate_vec[np.argmin(mz_diff)] = i
+            ms2_idx.append(i)
+
+    if len(ms2_idx) == 0:
+        return allocate_vec
+
+    ms2_idx = np.array(ms2_idx, dtype=np.int64)
+    precursor_mzs = np.array([d.scans[i].precursor_mz for i in ms2_idx], dtype=np.float64)
+    nearest_idx, mz_diff = _find_nearest_ions(d.scans[ms1_idx].mz_seq, precursor_mzs)
+    matched = mz_diff < 0.01
+
+    # if several MS2 scans point to the same ion, the last one is kept (the scan indices are increasing)
+    np.maximum.at(allocate_vec, nearest_idx[matched], ms2_idx[matched])
 
     return allocate_vec
 
@@ -252,9 +315,6 @@ class Roi:
         self.int_seq = [intensity]
         self.ms2_seq = []
 
-        # Count the gaps in the ROI's tail
-        self.gap_counter = 0
-
         # Create attributes for the summarized values of the ROI
         self.mz = mz
         self.rt = np.nan
@@ -356,7 +416,7 @@ class Roi:
         Function to find the retention time of the ROI.
         """
         
-        tmp = max(range(len(self.int_seq)), key=self.int_seq.__getitem__)
+        tmp = np.argmax(self.int_seq)
 
         self.rt = self.rt_seq[tmp]
         self.scan_number = self.scan_idx_seq[tmp]
@@ -379,7 +439,10 @@ class Roi:
         the heighest three intensities.
         """
 
-        d = np.sort(self.int_seq)[-num:]
+        # the order of the highest intensities doesn't matter for the mean, so a partition is enough
+        d = np.asarray(self.int_seq)
+        if len(d) > num:
+            d = np.partition(d, len(d) - num)[-num:]
         # calculate mean of non-zero values
         d = d[d != 0]
         self.top_average = np.mean(d, dtype=np.int64)
@@ -397,11 +460,11 @@ class Roi:
 
         end_idx += 1
 
-        # keep one zero in the end of ROI
-        self.mz_seq = self.mz_seq[:end_idx]
-        self.int_seq = self.int_seq[:end_idx]
-        self.rt_seq = self.rt_seq[:end_idx]
-        self.scan_idx_seq = self.scan_idx_seq[:end_idx]
+        # keep one zero in the end of ROI, and convert the traces to arrays once for the summary below
+        self.mz_seq = np.array(self.mz_seq[:end_idx])
+        self.int_seq = np.array(self.int_seq[:end_idx])
+        self.rt_seq = np.array(self.rt_seq[:end_idx])
+        self.scan_idx_seq = np.array(self.scan_idx_seq[:end_idx], dtype=np.int64)
         
         self.find_apex()
         self.find_roi_area()
@@ -420,6 +483,35 @@ class Roi:
         self.length = len(self.int_seq) - tmp
     
 
+    @classmethod
+    def _from_slice(cls, src, start, end):
+        """
+        Function to create a new ROI from a part of an existing ROI.
+        The lists and arrays are copied, but the MS2 spectra are shared with the source ROI.
+
+        Parameters
+        ----------------------------------------------------------
+        src: Roi object
+            The ROI to be sliced.
+        start: int
+            The start position of the new ROI.
+        end: int
+            The end position of the new ROI.
+        """
+
+        roi = cls.__new__(cls)
+        # copy the arrays too, otherwise adjacent segments would be views sharing the ion at the cut position
+        for k, v in vars(src).items():
+            if isinstance(v, list):
+                v = list(v)
+            elif isinstance(v, np.ndarray):
+                v = v.copy()
+            roi.__dict__[k] = v
+        roi.subset_roi(start, end)
+
+        return roi
+
+
     def subset_roi(self, start, end):
         """
         Function to subset the ROI by providing the positions.
@@ -460,7 +552,7 @@ def find_best_ms2(ms2_seq):
     """
 
     if len(ms2_seq) > 0:
-        total_ints = [np.sum(ms2.peaks[:,1]) for ms2 in ms2_seq]
+        total_ints = [ms2.total_int for ms2 in ms2_seq]
         if np.max(total_ints) == 0:
             return None
         else:
@@ -8,7 +8,6 @@ from pyteomics import mzml, mzxml
 import numpy as np
 import os
 from . import peak_detect
-import matplotlib.pyplot as plt
 import pandas as pd
 
 
@@ -50,7 +49,7 @@ class MSData:
         Parameters
         ----------------------------------------------------------
         file_name: str
-            File name of raw MS data (mzML or mzXML).
+            File name of raw MS data (mzML, mzMLb, or mzXML).
         params: Params object
             A Params object that contains the parameters.
         """
@@ -64,13 +63,27 @@ class MSData:
             self.file_name = os.path.splitext(os.path.basename(file_name))[0]
 
             if ext.lower() == ".mzml":
-                with mzml.MzML(file_name) as reader:
+                # indexed mzML stores the spectrum offsets, so the file doesn't have to be scanned to build an index
+                if _has_index_list(file_name):
+                    reader = mzml.PreIndexedMzML(file_name)
+                else:
+                    reader = mzml.MzML(file_name)
+                with reader:
                     self.extract_scan_mzml(reader)
             elif ext.lower() == ".mzxml":
                 with mzxml.MzXML(file_name) as reader:
                     self.extract_scan_mzxml(reader)
+            elif ext.lower() == ".mzmlb":
+                # mzMLb (HDF5-based mzML) needs h5py, so it's only imported for mzMLb files
+                try:
+                    from pyteomics import mzmlb
+                except ImportError as e:
+                    raise ImportError("Reading mzMLb files requires h5py and hdf5plugin. "
+                                      "Install them with: pip install metabengine[mzmlb]") from e
+                with mzmlb.MzMLb(file_name) as reader:
+                    self.extract_scan_mzml(reader)
             else:
-                print("Unsupported raw data format. Raw data must be in mzML or mzXML.")
+                print("Unsupported raw data format. Raw data must be in mzML, mzMLb, or mzXML.")
         else:
             print("File does not exist.")
 
@@ -166,8 +179,8 @@ class MSData:
                     self.ms1_idx.append(idx)
 
                     # update base peak chromatogram
-                    self.bpc_int = np.append(self.bpc_int, np.max(spec['intensity array']))
-                    self.ms1_rt_seq = np.append(self.ms1_rt_seq, rt)
+                    self.bpc_int.append(np.max(spec['intensity array']))
+                    self.ms1_rt_seq.append(rt)
 
                 elif spec['msLevel'] == 2:
                     temp_scan = Scan(level=2, scan=idx, rt=rt)
@@ -194,9 +207,14 @@ class MSData:
             Intensity tolerance.
         """
 
+        int_tol = self.params.int_tol
+
         for idx in self.ms1_idx:
-            self.scans[idx].mz_seq = self.scans[idx].mz_seq[self.scans[idx].int_seq > self.params.int_tol]
-            self.scans[idx].int_seq = self.scans[idx].int_seq[self.scans[idx].int_seq > self.params.int_tol]
+            scan = self.scans[idx]
+            # compute the mask once and apply it to both arrays
+            mask = scan.int_seq > int_tol
+            scan.mz_seq = scan.mz_seq[mask]
+            scan.int_seq = scan.int_seq[mask]
 
 
     def find_rois(self):
@@ -257,17 +275,12 @@ class MSData:
 
         for roi in self.rois:
             roi.sum_roi()
-
-            roi.int_seq = np.array(roi.int_seq)
             
-            # 1. find roi quality by length
+            # find roi quality by length (the best MS2 is already found in sum_roi)
             if roi.length >= self.params.min_ion_num:
                 roi.quality = 'good'
             else:
                 roi.quality = 'short'
-            
-            # 2. find the best MS2
-            roi.find_best_ms2()
 
         self.rois.sort(key=lambda x: x.mz)
         for idx in range(len(self.rois)):
@@ -304,15 +317,13 @@ class MSData:
 
         for roi in self.rois:
             roi.sum_roi()
-            roi.int_seq = np.array(roi.int_seq)
             # 1. find roi quality by length
             if roi.length >= self.params.min_ion_num:
                 roi.quality = 'good'
             else:
                 roi.quality = 'short'
             
-            # 2. find the best MS2
-            roi.find_best_ms2()
+            # 2. the best MS2 is already found in sum_roi, so the MS2 list can be released
             roi.ms2_seq = []
         
         self.drop_rois_by_length()
@@ -342,6 +353,8 @@ class MSData:
             Output file name. If not specified, the plot will be shown.
         """
 
+        import matplotlib.pyplot as plt
+
         plt.figure(figsize=(10, 3))
         plt.rcParams['font.size'] = 14
         plt.rcParams['font.family'] = 'Arial'
@@ -436,50 +449,53 @@ class MSData:
             Scan index of the EIC.
         """
 
-        eic_rt = []
-        eic_int = []
-        eic_mz = []
-        eic_scan_idx = []
-
         if target_rt is None:
             rt_range = [0, np.inf]
         else:
             rt_range = [target_rt - rt_tol, target_rt + rt_tol]
 
-        for i in self.ms1_idx:
-            if self.scans[i].rt > rt_range[0] and self.scans[i].rt < rt_range[1]:
-                mz_diff = np.abs(self.scans[i].mz_seq - target_mz)
-                if len(mz_diff)>0 and np.min(mz_diff) < mz_tol:
-                    eic_rt.append(self.scans[i].rt)
-                    eic_int.append(self.scans[i].int_seq[np.argmin(mz_diff)])
-                    eic_mz.append(self.scans[i].mz_seq[np.argmin(mz_diff)])
-                    eic_scan_idx.append(i)
-                else:
-                    eic_rt.append(self.scans[i].rt)
-                    eic_int.append(0)
-                    eic_mz.append(0)
-                    eic_scan_idx.append(i)
-
-            if self.scans[i].rt > rt_range[1]:
-                break
-        
-        eic_rt = np.array(eic_rt)
-        eic_int = np.array(eic_int)
-        eic_mz = np.array(eic_mz)
-        eic_scan_idx = np.array(eic_scan_idx)
+        # select the MS1 scans in the RT range first, so the outputs can be preallocated
+        ms1_idx = np.array(self.ms1_idx, dtype=np.int64)
+        ms1_rt = np.array([self.scans[i].rt for i in self.ms1_idx], dtype=np.float64)
+        # scans after the first one beyond the RT range are not checked
+        stop = np.argmax(ms1_rt > rt_range[1]) if np.any(ms1_rt > rt_range[1]) else len(ms1_rt)
+        selected = np.where((ms1_rt[:stop] > rt_range[0]) & (ms1_rt[:stop] < rt_range[1]))[0]
+
+        eic_rt = ms1_rt[selected]
+        eic_int = np.zeros(len(selected), dtype=np.int64)
+        eic_mz = np.zeros(len(selected), dtype=np.float64)
+        eic_scan_idx = ms1_idx[selected]
+
+        for k, i in enumerate(eic_scan_idx):
+            mz_diff = np.abs(self.scans[i].mz_seq - target_mz)
+            if len(mz_diff) == 0:
+                continue
+            # locate the nearest ion once and reuse it for the tolerance check, intensity, and m/z
+            min_idx = np.argmin(mz_diff)
+            if mz_diff[min_idx] < mz_tol:
+                eic_int[k] = self.scans[i].int_seq[min_idx]
+                eic_mz[k] = self.scans[i].mz_seq[min_idx]
 
         return eic_rt, eic_int, eic_mz, eic_scan_idx
 
 
     def find_roi_by_mzrt(self, mz, rt, mz_tol=0.005, rt_tol=0.3):
         rois = []
-        for roi in self.rois:
-            if np.abs(roi.mz - mz) < mz_tol and np.abs(roi.rt - rt) < rt_tol:
-                roi.show_roi_info()
-                print("a total of " + str(roi.length) + " scans")
-                print("roi start: " + str(roi.rt_seq[0]) and "roi end: " + str(roi.rt_seq[-1]))
-                print("------------------")
-                rois.append(roi)
+
+        # check the m/z and RT of all rois at once instead of one roi at a time
+        mz_seq = np.array([roi.mz for roi in self.rois], dtype=np.float64)
+        rt_seq = np.array([roi.rt for roi in self.rois], dtype=np.float64)
+        # two-sided bounds avoid the temporary arrays of np.abs(x - target)
+        matched = (mz_seq > mz - mz_tol) & (mz_seq < mz + mz_tol) & (rt_seq > rt - rt_tol) & (rt_seq < rt + rt_tol)
+        matched = np.where(matched)[0]
+
+        for i in matched:
+            roi = self.rois[i]
+            roi.show_roi_info()
+            print("a total of " + str(roi.length) + " scans")
+            print("roi start: " + str(roi.rt_seq[0]) and "roi end: " + str(roi.rt_seq[-1]))
+            print("------------------")
+            rois.append(roi)
 
         return rois     
     
@@ -489,6 +505,8 @@ class MSData:
         Function to plot EIC of a target m/z.
         """
 
+        import matplotlib.pyplot as plt
+
         # get the eic data
         eic_rt, eic_int, _, eic_scan_idx = self.get_eic_data(target_mz, mz_tol=mz_tol, rt_range=rt_range)
 
@@ -547,7 +565,7 @@ class MSData:
 
         if return_best:
             if len(matched_ms2) > 1:
-                total_ints = [np.sum(ms2.peaks[:,1]) for ms2 in matched_ms2]
+                total_ints = [ms2.total_int for ms2 in matched_ms2]
                 return matched_ms2[np.argmax(total_ints)]
             elif len(matched_ms2) == 1:
                 return matched_ms2[0]
@@ -562,6 +580,8 @@ class MSData:
         Function to plot EIC of a target m/z.
         """
 
+        import matplotlib.pyplot as plt
+
         if rt_window is not None:
             rt_range = [self.rois[roi_idx].rt - rt_window, self.rois[roi_idx].rt + rt_window]
 
@@ -594,6 +614,8 @@ class MSData:
         Function to plot EIC of all ROIs.
         """
 
+        import matplotlib.pyplot as plt
+
         if output_path[-1] != "/":
             output_path += "/"
 
@@ -689,6 +711,7 @@ class Scan:
         # for MS2 scans:
         self.precursor_mz = None
         self.peaks = None
+        self.total_int = 0.0
     
 
     def add_info_by_level(self, **kwargs):
@@ -703,6 +726,7 @@ class Scan:
         elif self.level == 2:
             self.precursor_mz = kwargs['precursor_mz']
             self.peaks = kwargs['peaks']
+            self.total_int = np.sum(self.peaks[:, 1])
 
 
     def show_scan_info(self):
@@ -736,6 +760,8 @@ class Scan:
         ----------------------------------------------------------
         """
 
+        import matplotlib.pyplot as plt
+
         if self.level == 1:
             x = self.mz_seq
             y = self.int_seq
@@ -762,6 +788,18 @@ class Scan:
         plt.show()
 
 
+def _has_index_list(file_name):
+    """
+    A function to check if a mzML file is indexed, i.e. it ends with
+    an index list of the byte offsets of the spectra.
+    """
+
+    with open(file_name, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - 1024, 0))
+        return b"<indexListOffset>" in f.read()
+
+
 def _clean_ms2(ms2, offset=1.5, int_threshold=1000):
     """
     A function to clean MS/MS by
@@ -775,4 +813,7 @@ def _clean_ms2(ms2, offset=1.5, int_threshold=1000):
     if ms2.peaks.shape[0] > 0:
         ms2.peaks = ms2.peaks[ms2.peaks[:, 1] > 0.01 * np.max(ms2.peaks[:, 1])]
     if ms2.peaks.shape[0] > 0:
-        ms2.peaks = ms2.peaks[ms2.peaks[:, 1] > int_threshold]
\ No newline at end of file
+        ms2.peaks = ms2.peaks[ms2.peaks[:, 1] > int_threshold]
+
+    # summed intensity, used to choose the best MS/MS
+    ms2.total_int = np.sum(ms2.peaks[:, 1])
\ No newline at end of file
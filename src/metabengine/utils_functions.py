@@ -1,8 +1,12 @@
+from functools import lru_cache
+import re
 from pyteomics import mass
 from ms_entropy import calculate_entropy_similarity
 import numpy as np
 
 
+# the same formula and adduct are often requested many times, e.g. for a list of internal standards
+@lru_cache(maxsize=None)
 def cal_ion_mass(formula, adduct, charge):
     """
     A function to calculate the ion mass of a given formula, adduct and charge.
@@ -23,9 +27,9 @@ def cal_ion_mass(formula, adduct, charge):
         The ion mass of the given formula, adduct and charge.
     """
 
-    # if there is a D in the formula, and not followed by a lowercase letter, replace it with H[2]
-    if 'D' in formula and not formula[formula.find('D') + 1].islower():
-        formula = formula.replace('D', 'H[2]')
+    # replace every D that is not followed by a lowercase letter (e.g. Dy) with H[2]
+    if 'D' in formula:
+        formula = _DEUTERIUM.sub('H[2]', formula)
 
     # calculate the ion mass
     final_formula = formula + adduct
@@ -33,6 +37,7 @@ def cal_ion_mass(formula, adduct, charge):
     return ion_mass
 
 _ELECTRON_MASS = 0.00054858
+_DEUTERIUM = re.compile(r'D(?![a-z])')
 
 
 def ms2_grouping(ms2_list, precursor_mz_tol=0.01, similarity_tol=0.8):
@@ -2,11 +2,9 @@
 
 # A module for data visualization.
 
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
+# matplotlib is imported inside the plotting functions, so it's not loaded with the package
 import random
 import numpy as np
-import networkx as nx
 from .annotation import feature_to_feature_search
 
 def plot_bpcs(data_list=None, output=None, autocolor=False):
@@ -19,6 +17,8 @@ def plot_bpcs(data_list=None, output=None, autocolor=False):
         A list of data to be plotted.
     """
 
+    import matplotlib.pyplot as plt
+
     if data_list is not None:
         if autocolor:
             color_list = _color_list
@@ -45,6 +45,8 @@ def plot_bpcs(data_list=None, output=None, autocolor=False):
 
 
 def random_color_generator():
+    import matplotlib.colors as mcolors
+
     # set seed
     color = random.choice(list(mcolors.CSS4_COLORS.keys()))
     return color
@@ -58,6 +60,8 @@ def plot_roi(d, roi, mz_tol=0.01, rt_range=[0, np.inf], rt_window=None, output=F
     Function to plot EIC of a target m/z.
     """
 
+    import matplotlib.pyplot as plt
+
     if rt_window is not None:
         rt_range = [roi.rt_seq[0] - rt_window, roi.rt_seq[-1] + rt_window]
     
@@ -98,6 +102,8 @@ def plot_roi(d, roi, mz_tol=0.01, rt_range=[0, np.inf], rt_window=None, output=F
 
 def plot_hist(arr, bins, x_label, y_label):
 
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(6, 3))
     plt.rcParams['font.size'] = 14
     plt.rcParams['font.family'] = 'Arial'
@@ -121,6 +127,8 @@ def mirror_ms2_from_scans(scan1, scan2, output=False):
 
 def mirror_ms2(precursor_mz1, precursor_mz2, peaks1, peaks2, output=False):
 
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(10, 3))
     plt.rcParams['font.size'] = 14
     plt.rcParams['font.family'] = 'Arial'
@@ -148,6 +156,8 @@ def mirror_ms2(precursor_mz1, precursor_mz2, peaks1, peaks2, output=False):
 
 def mirror_ms2_db(f, output=False):
 
+    import matplotlib.pyplot as plt
+
     precursor_mz1 = f.mz
     precursor_mz2 = f.matched_precursor_mz
     peaks1 = f.best_ms2.peaks
@@ -206,6 +216,8 @@ def plot_network(feature_list, annotation_type="hybrid_and_identity", feature_qu
         "bad" - only bad features (quality=="bad peak shape").
     """
 
+    import matplotlib.pyplot as plt
+
     # prepare feature list
     selected_features = _prepare_feature_list_for_network(feature_list, annotation_type, feature_quality)
 
@@ -222,6 +234,9 @@ def plot_network(feature_list, annotation_type="hybrid_and_identity", feature_qu
             else:
                 df.loc[len(df)] = [f.network_name, "DB_"+f.annotation, f.similarity, f.id, "DB"]
 
+    # networkx is only needed for this plot, so it is not imported with the package
+    import networkx as nx
+
     # Create a new graph
     G = nx.Graph()
 
@@ -358,6 +373,8 @@ def _color_gradient(s, color_1, color_2):
     A function to generate a color based on the similarity score.
     """
 
+    import matplotlib.colors as mcolors
+
     color_1 = mcolors.to_rgb(color_1)
     color_2 = mcolors.to_rgb(color_2)
 
@@ -0,0 +1,116 @@
+import os
+import pickle
+
+import pytest
+
+from metabengine import annotation
+
+
+_MSP = """Name: compound_a
+PrecursorMZ: 180.0634
+Num Peaks: 2
+85.0284 100
+163.0601 50
+
+Name: compound_b
+PrecursorMZ: 132.1019
+Num Peaks: 2
+86.0964 100
+69.0699 20
+
+"""
+
+
+def _names(entropy_search):
+    # the indexed spectra are sorted by precursor m/z
+    return [entropy_search[i]["name"] for i in range(len(entropy_search.precursor_mz_array))]
+
+
+@pytest.fixture
+def msp_path(tmp_path):
+    path = tmp_path / "library.msp"
+    path.write_text(_MSP)
+    return str(path)
+
+
+@pytest.fixture
+def count_builds(monkeypatch):
+    # parse the MSP file with typed values and count how often it's parsed, i.e. how often the index is rebuilt
+    calls = []
+
+    def read_one_spectrum(path):
+        calls.append(path)
+        with open(path) as f:
+            blocks = f.read().strip().split("\n\n")
+        for block in blocks:
+            lines = block.splitlines()
+            meta = dict(line.split(": ", 1) for line in lines if ": " in line)
+            peaks = [[float(v) for v in line.split()] for line in lines if ": " not in line]
+            yield {"name": meta["Name"], "precursor_mz": float(meta["PrecursorMZ"]), "peaks": peaks}
+
+    monkeypatch.setattr(annotation, "read_one_spectrum", read_one_spectrum)
+    return calls
+
+
+def test_msms_db_cache_is_written_and_reused(msp_path, count_builds):
+    first = annotation.load_msms_db(msp_path)
+    assert os.path.exists(annotation._msms_db_cache_path(msp_path))
+
+    second = annotation.load_msms_db(msp_path)
+    assert len(count_builds) == 1
+    assert _names(second) == _names(first) == ["compound_b", "compound_a"]
+
+
+def test_msms_db_cache_path_contains_ms_entropy_version(msp_path):
+    cache_path = annotation._msms_db_cache_path(msp_path)
+    assert cache_path.startswith(msp_path + ".ms_entropy-")
+    assert cache_path.endswith(".pkl")
+
+
+def test_msms_db_cache_invalidated_when_msp_mtime_changes(msp_path, count_builds):
+    annotation.load_msms_db(msp_path)
+    st = os.stat(msp_path)
+    os.utime(msp_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    annotation.load_msms_db(msp_path)
+    assert len(count_builds) == 2
+
+
+def test_msms_db_cache_invalidated_when_msp_size_changes(msp_path, count_builds):
+    annotation.load_msms_db(msp_path)
+    st = os.stat(msp_path)
+    with open(msp_path, "a") as f:
+        f.write("Name: compound_c\nPrecursorMZ: 147.0764\nNum Peaks: 1\n84.0444 100\n\n")
+    # keep the modification time, so only the size tells the files apart
+    os.utime(msp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    entropy_search = annotation.load_msms_db(msp_path)
+    assert len(count_builds) == 2
+    assert len(_names(entropy_search)) == 3
+
+
+def test_msms_db_cache_rebuilt_from_corrupt_file(msp_path, count_builds):
+    annotation.load_msms_db(msp_path)
+    cache_path = annotation._msms_db_cache_path(msp_path)
+    with open(cache_path, "wb") as f:
+        f.write(b"\x80\x05truncated")
+
+    entropy_search = annotation.load_msms_db(msp_path)
+    assert len(count_builds) == 2
+    assert len(_names(entropy_search)) == 2
+
+    # the corrupt file is replaced by a valid cache
+    with open(cache_path, "rb") as f:
+        assert pickle.load(f)["msp_size"] == os.stat(msp_path).st_size
+    annotation.load_msms_db(msp_path)
+    assert len(count_builds) == 2
+
+
+def test_failed_cache_write_leaves_no_files(tmp_path):
+    class Unpicklable:
+        def __reduce__(self):
+            raise pickle.PicklingError("can't pickle")
+
+    cache_path = str(tmp_path / "library.msp.pkl")
+    annotation._write_msms_db_cache(Unpicklable(), cache_path, os.stat(tmp_path))
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,37 @@
+import warnings
+
+import numpy as np
+from scipy.stats import pearsonr
+
+from metabengine.feature_grouping import _pearson
+
+
+def test_pearson_matches_scipy():
+    rng = np.random.default_rng(0)
+    for n in (2, 3, 10, 100):
+        for _ in range(50):
+            x = rng.uniform(0, 1e6, n)
+            y = x * rng.uniform(-2, 2) + rng.normal(0, 1e5, n)
+            assert np.isclose(_pearson(x, y), pearsonr(x, y)[0], rtol=1e-12, atol=1e-12)
+
+
+def test_pearson_integer_intensities():
+    x = np.array([0, 1200, 5400, 9800, 4300, 0], dtype=np.int64)
+    y = np.array([0, 800, 3000, 6100, 2500, 100], dtype=np.int64)
+    assert np.isclose(_pearson(x, y), pearsonr(x, y)[0], rtol=1e-12)
+
+
+def test_pearson_is_clipped_to_unit_range():
+    x = np.array([1e8, 1e8 + 1, 1e8 + 2])
+    assert _pearson(x, x) == 1.0
+    assert _pearson(x, -x) == -1.0
+
+
+def test_pearson_constant_input_is_nan():
+    x = np.array([5.0, 5.0, 5.0, 5.0])
+    y = np.array([1.0, 2.0, 3.0, 4.0])
+    with warnings.catch_warnings():
+        # like pearsonr and np.corrcoef, constant input gives nan (with a warning)
+        warnings.simplefilter("ignore")
+        assert np.isnan(_pearson(x, y))
+        assert np.isnan(pearsonr(x, y)[0])
@@ -0,0 +1,94 @@
+import numpy as np
+
+from metabengine.peak_detect import Roi, _find_nearest_ions, roi_cutter
+
+
+def _argmin_reference(mz_seq, target_mzs):
+    diff = np.abs(mz_seq[None, :] - target_mzs[:, None])
+    return np.argmin(diff, axis=1), np.min(diff, axis=1)
+
+
+def test_find_nearest_ions_equal_distance_picks_first_index():
+    mz_seq = np.array([100.0, 101.0, 102.0])
+    nearest_idx, mz_diff = _find_nearest_ions(mz_seq, np.array([100.5, 101.5]))
+    assert nearest_idx.tolist() == [0, 1]
+    assert mz_diff.tolist() == [0.5, 0.5]
+
+
+def test_find_nearest_ions_duplicate_mz_picks_first_index():
+    mz_seq = np.array([100.0, 100.5, 100.5, 101.0])
+    nearest_idx, _ = _find_nearest_ions(mz_seq, np.array([100.6, 100.4, 100.5]))
+    assert nearest_idx.tolist() == [1, 1, 1]
+
+
+def test_find_nearest_ions_matches_argmin():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        # rounded values give both duplicates and equal distances
+        mz_seq = np.sort(np.round(rng.uniform(100, 105, rng.integers(1, 20)), 1))
+        target_mzs = np.round(rng.uniform(99, 106, 20), 2)
+        nearest_idx, mz_diff = _find_nearest_ions(mz_seq, target_mzs)
+        ref_idx, ref_diff = _argmin_reference(mz_seq, target_mzs)
+        assert nearest_idx.tolist() == ref_idx.tolist()
+        assert mz_diff.tolist() == ref_diff.tolist()
+
+
+def test_find_nearest_ions_empty_scan():
+    nearest_idx, mz_diff = _find_nearest_ions(np.array([]), np.array([100.0, 200.0]))
+    assert len(nearest_idx) == 2
+    assert np.all(np.isinf(mz_diff))
+
+
+class _MS2:
+    def __init__(self, scan):
+        self.scan = scan
+
+
+def _make_roi(as_arrays):
+    roi = Roi(scan_idx=0, rt=0.0, mz=100.0, intensity=0)
+    for i, intensity in enumerate([5, 9, 4, 2, 8, 9, 3, 0], start=1):
+        roi.extend_roi(scan_idx=i, rt=i * 0.01, mz=100.0 + i * 1e-4, intensity=intensity)
+    roi.ms2_seq = [_MS2(2), _MS2(6)]
+    if as_arrays:
+        roi.mz_seq = np.array(roi.mz_seq)
+        roi.int_seq = np.array(roi.int_seq, dtype=np.float64)
+        roi.rt_seq = np.array(roi.rt_seq)
+        roi.scan_idx_seq = np.array(roi.scan_idx_seq, dtype=np.int64)
+    return roi
+
+
+def test_from_slice_copies_traces():
+    for as_arrays in (False, True):
+        roi = _make_roi(as_arrays)
+        parent_int = list(roi.int_seq)
+        parent_mz = list(roi.mz_seq)
+
+        part = Roi._from_slice(roi, 2, 6)
+        assert list(part.int_seq) == parent_int[2:6]
+        assert list(part.scan_idx_seq) == [2, 3, 4, 5]
+
+        part.int_seq[0] = -1
+        part.mz_seq[0] = np.nan
+        assert list(roi.int_seq) == parent_int
+        assert list(roi.mz_seq) == parent_mz
+
+
+def test_from_slice_keeps_ms2_inside_the_slice():
+    roi = _make_roi(as_arrays=False)
+    part = Roi._from_slice(roi, 1, 5)
+    assert [ms2.scan for ms2 in part.ms2_seq] == [2]
+    # the MS2 spectra are shared, not copied
+    assert part.ms2_seq[0] is roi.ms2_seq[0]
+    assert len(roi.ms2_seq) == 2
+
+
+def test_roi_cutter_segments_do_not_share_the_cut_ion():
+    roi = _make_roi(as_arrays=True)
+    first, second = roi_cutter(roi, [4])
+    cut_int = first.int_seq[-1]
+
+    # sum_roi writes nan to the first m/z of a segment that starts with a zero
+    second.mz_seq[0] = np.nan
+    second.int_seq[0] = -1
+    assert first.int_seq[-1] == cut_int
+    assert not np.isnan(first.mz_seq[-1])